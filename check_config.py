@@ -8,6 +8,30 @@ Checks sender and receiver configuration for mismatches
 
 import sys
 import os
+import re
+import stat
+import grp
+import pwd
+
+# Configuration patterns: (key, regex source with one value group, value type)
+_CONFIG_PATTERNS = [
+    ('serial_num', r'serial_num\s*=\s*["\']([^"\']+)["\']', str),
+    ('freq', r'freq\s*=\s*(\d+)', int),
+    ('addr', r'addr\s*=\s*(\d+)', int),                # Own address
+    ('target_addr', r'target_addr\s*=\s*(\d+)', int),  # Sender only
+    ('power', r'power\s*=\s*(\d+)', int),
+    ('air_speed', r'air_speed\s*=\s*(\d+)', int),
+    ('buffer_size', r'buffer_size\s*=\s*(\d+)', int),
+]
+
+# All patterns joined into one alternation so the file is scanned once.
+# Each key gets a named group, directly followed by its value group.
+# No two alternatives can match at the same position, so their order
+# only decides the display order of the results.
+_CONFIG_RE = re.compile('|'.join(
+    f"(?P<{key}>{source})" for key, source, _ in _CONFIG_PATTERNS
+))
+_CONFIG_CASTS = {key: cast for key, _, cast in _CONFIG_PATTERNS}
 
 print("\n" + "="*70)
 print("LoRa Image Transmission - Configuration Diagnostic")
@@ -25,51 +49,22 @@ def check_file_exists(filename):
 def extract_config(filename, config_name):
     """Extract configuration from Python file"""
     try:
-        with open(filename, 'r') as f:
-            content = f.read()
-            
-        # Simple regex-like extraction
-        configs = {}
+        # Single pass over the file, keeping the first occurrence of each key
+        found = {}
         
-        # Look for common patterns
-        import re
-        
-        # Extract serial_num
-        match = re.search(r'serial_num\s*=\s*["\']([^"\']+)["\']', content)
-        if match:
-            configs['serial_num'] = match.group(1)
-            
-        # Extract freq
-        match = re.search(r'freq\s*=\s*(\d+)', content)
-        if match:
-            configs['freq'] = int(match.group(1))
-            
-        # Extract addr (own address)
-        match = re.search(r'addr\s*=\s*(\d+)', content)
-        if match:
-            configs['addr'] = int(match.group(1))
-            
-        # Extract target_addr (for sender)
-        match = re.search(r'target_addr\s*=\s*(\d+)', content)
-        if match:
-            configs['target_addr'] = int(match.group(1))
-            
-        # Extract power
-        match = re.search(r'power\s*=\s*(\d+)', content)
-        if match:
-            configs['power'] = int(match.group(1))
-            
-        # Extract air_speed
-        match = re.search(r'air_speed\s*=\s*(\d+)', content)
-        if match:
-            configs['air_speed'] = int(match.group(1))
+        with open(filename, 'r', buffering=65536) as f:
+            for line in f:
+                # Every pattern is an assignment
+                if '=' not in line:
+                    continue
+                for match in _CONFIG_RE.finditer(line):
+                    key = match.lastgroup
+                    if key not in found:
+                        found[key] = _CONFIG_CASTS[key](match.group(match.lastindex + 1))
+                if len(found) == len(_CONFIG_PATTERNS):
+                    break
             
-        # Extract buffer_size
-        match = re.search(r'buffer_size\s*=\s*(\d+)', content)
-        if match:
-            configs['buffer_size'] = int(match.group(1))
-            
-        return configs
+        return {key: found[key] for key, _, _ in _CONFIG_PATTERNS if key in found}
     except Exception as e:
         print(f"Error reading {filename}: {e}")
         return {}
@@ -173,13 +168,16 @@ print("SYSTEM CHECK")
 print("="*70)
 
 # Check serial port
-import os
-if os.path.exists("/dev/ttyS0"):
+# One stat call tells us both whether the port exists and its permissions
+try:
+    st = os.stat("/dev/ttyS0")
+except OSError:
+    st = None
+
+if st is not None:
     print(f"✓ Serial port /dev/ttyS0 exists")
     
     # Check permissions
-    import stat
-    st = os.stat("/dev/ttyS0")
     if st.st_mode & stat.S_IRWXG:
         print(f"✓ Serial port has group permissions")
     else:
@@ -190,10 +188,8 @@ else:
     issues_found = True
 
 # Check user groups
-import grp
 try:
     dialout_group = grp.getgrnam('dialout')
-    import pwd
     username = pwd.getpwuid(os.getuid()).pw_name
     
     if username in dialout_group.gr_mem:
@@ -7,11 +7,16 @@ Use this to troubleshoot communication issues
 """
 
 import sys
+import os
+import select
+import struct
 import sx126x
-import time
 import termios
 import tty
 
+# [target_addr: 2] [target_freq_offset: 1] [sender_addr: 2] [sender_freq_offset: 1]
+HEADER_FMT = struct.Struct('>HBHB')
+
 print("\n" + "="*60)
 print("LoRa Debug Receiver - Raw Data Monitor")
 print("="*60 + "\n")
@@ -45,11 +50,18 @@ try:
     
     packet_count = 0
     
+    # Read the serial port's file descriptor directly, bypassing pyserial
+    fd = node.ser.fileno()
+    
     while True:
-        if node.ser.inWaiting() > 0:
+        # Block until data arrives instead of polling
+        if select.select([fd], [], [], 0.3)[0]:
             packet_count += 1
-            time.sleep(0.1)  # Wait for full packet
-            raw_data = node.ser.read(node.ser.inWaiting())
+            # Keep reading until the line has been quiet for 20 ms,
+            # which marks the end of the packet
+            raw_data = bytearray(os.read(fd, 4096))
+            while select.select([fd], [], [], 0.02)[0]:
+                raw_data.extend(os.read(fd, 4096))
             
             print(f"\n{'='*60}")
             print(f"Packet #{packet_count} - Received {len(raw_data)} bytes")
@@ -57,17 +69,14 @@ try:
             
             # Show raw bytes (hex)
             print("Raw data (hex):")
-            hex_str = ' '.join([f'{b:02x}' for b in raw_data[:100]])  # First 100 bytes
+            hex_str = raw_data[:100].hex(' ')  # First 100 bytes
             print(f"  {hex_str}")
             if len(raw_data) > 100:
                 print(f"  ... (+ {len(raw_data) - 100} more bytes)")
             
             # Parse header
-            if len(raw_data) >= 6:
-                target_addr = (raw_data[0] << 8) + raw_data[1]
-                target_freq = raw_data[2]
-                sender_addr = (raw_data[3] << 8) + raw_data[4]
-                sender_freq = raw_data[5]
+            if len(raw_data) >= HEADER_FMT.size:
+                target_addr, target_freq, sender_addr, sender_freq = HEADER_FMT.unpack_from(raw_data)
                 
                 print(f"\nHeader info:")
                 print(f"  Target address: {target_addr}")
@@ -82,35 +91,37 @@ try:
                     print(f"  ✗ Packet NOT for us (target={target_addr}, we are 1)")
             
             # Show payload
-            if len(raw_data) > 6:
-                payload = raw_data[6:]
+            if len(raw_data) > HEADER_FMT.size:
+                # A view, so the payload isn't copied out of raw_data
+                payload = memoryview(raw_data)[HEADER_FMT.size:]
                 print(f"\nPayload ({len(payload)} bytes):")
                 
                 # Try to interpret as text
                 try:
                     # Check for known headers
-                    if payload.startswith(b'IMGSTART'):
+                    tag = bytes(payload[:8])
+                    if tag.startswith(b'IMGSTART'):
                         print("  Type: START packet")
-                    elif payload.startswith(b'IMGDATA'):
+                    elif tag.startswith(b'IMGDATA'):
                         print("  Type: DATA packet")
-                    elif payload.startswith(b'IMG_END'):
+                    elif tag.startswith(b'IMGMULT'):
+                        print("  Type: MULTI-CHUNK DATA packet")
+                    elif tag.startswith(b'IMG_END'):
                         print("  Type: END packet")
                     else:
                         # Try to decode as text
-                        text_preview = payload[:50].decode('utf-8', errors='replace')
+                        text_preview = bytes(payload[:50]).decode('utf-8', errors='replace')
                         print(f"  Preview: {text_preview}")
                 except:
                     print(f"  (Binary data)")
                 
                 # Show first bytes
-                hex_payload = ' '.join([f'{b:02x}' for b in payload[:50]])
+                hex_payload = payload[:50].hex(' ')
                 print(f"  Hex: {hex_payload}")
                 if len(payload) > 50:
                     print(f"       ... (+ {len(payload) - 50} more bytes)")
             
             print("-" * 60)
-        
-        time.sleep(0.01)  # Small delay
 
 except KeyboardInterrupt:
     print("\n\nDebug receiver stopped by user")
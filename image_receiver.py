@@ -10,10 +10,24 @@ import sys
 import sx126x
 import time
 import os
+import select
 import hashlib
+import struct
+import zlib
 import termios
+import traceback
 import tty
 
+# LoRa addressing header of outgoing ACKs:
+# [target_addr: 2] [target_freq_offset: 1] [own_addr: 2] [own_freq_offset: 1]
+HEADER_FMT = struct.Struct('>HBHB')
+
+# Fixed-size fields of the image packets (big-endian)
+START_SIZES_FMT = struct.Struct('>II')   # [filesize: 4] [total_chunks: 4]
+CHUNK_NUM_FMT = struct.Struct('>I')      # [chunk_num: 4]
+MULTI_HEADER_FMT = struct.Struct('>IB')  # [first_chunk: 4] [count: 1]
+CRC_FMT = struct.Struct('>I')            # [crc: 4] CRC-32 of the payload
+
 class ImageReceiver:
     def __init__(self, serial_num="/dev/ttyS0", freq=868, addr=1, power=22, 
                  output_dir="received_images"):
@@ -38,6 +52,15 @@ class ImageReceiver:
             buffer_size=240,
             relay=False
         )
+        # Blocking reads return after this many seconds without data
+        self.node.ser.timeout = 0.3
+        # Where the payload ends in a received frame: the module appends
+        # one RSSI byte when RSSI reporting is enabled
+        self._payload_end = -1 if self.node.rssi else None
+        # ACKs always go back to the sender (address 0) on our own channel,
+        # so their addressing header is packed once
+        self.ack_header = HEADER_FMT.pack(0, self.node.offset_freq,
+                                          self.node.addr, self.node.offset_freq)
         
         self.output_dir = output_dir
         if not os.path.exists(output_dir):
@@ -50,25 +73,45 @@ class ImageReceiver:
         self.filesize = 0
         self.total_chunks = 0
         self.expected_checksum = None
-        self.received_chunks = {}
+        self.part_path = None              # Image data, written in place on disk
+        self.part_fd = None
+        self.chunk_received = bytearray()  # One flag byte per chunk
+        self.received_count = 0
+        self.image_md5 = None              # Running MD5 while chunks arrive in order
+        self.next_chunk = 0
         self.start_time = None
         self.last_packet_time = None
         self.packet_times = []  # Track time between packets for ETA
         
+        # Packet handlers by tag; each returns the ID to ACK, or None
+        self.packet_handlers = {
+            b'IMGSTART': self.handle_start_packet,
+            b'IMGDATA': self.handle_data_packet,
+            b'IMGMULT': self.handle_multi_packet,
+            b'IMG_END': self.handle_end_packet,
+        }
+        
         print("LoRa module initialized successfully!")
         
-    def calculate_checksum(self, data):
-        """Calculate MD5 checksum of data"""
-        return hashlib.md5(data).hexdigest()
-    
     def reset_state(self):
         """Reset receiver state"""
+        # A transfer that never finished leaves no partial file behind
+        if self.part_fd is not None:
+            os.close(self.part_fd)
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+        
         self.receiving = False
         self.filename = None
         self.filesize = 0
         self.total_chunks = 0
         self.expected_checksum = None
-        self.received_chunks = {}
+        self.part_path = None              # Image data, written in place on disk
+        self.part_fd = None
+        self.chunk_received = bytearray()  # One flag byte per chunk
+        self.received_count = 0
+        self.image_md5 = None              # Running MD5 while chunks arrive in order
+        self.next_chunk = 0
         self.start_time = None
         self.last_packet_time = None
         self.packet_times = []
@@ -80,16 +123,7 @@ class ImageReceiver:
             
             # Format ACK packet with proper LoRa addressing
             # [target_addr_high] [target_addr_low] [freq_offset] [own_addr_high] [own_addr_low] [own_freq_offset] [payload]
-            sender_addr = 0  # The sender's address (default is 0)
-            offset_freq = self.node.offset_freq
-            
-            packet = bytes([sender_addr >> 8])  # Target address high byte
-            packet += bytes([sender_addr & 0xff])  # Target address low byte
-            packet += bytes([offset_freq])  # Target frequency offset
-            packet += bytes([self.node.addr >> 8])  # Own address high byte
-            packet += bytes([self.node.addr & 0xff])  # Own address low byte
-            packet += bytes([self.node.offset_freq])  # Own frequency offset
-            packet += ack_message
+            packet = self.ack_header + ack_message
             
             self.node.send(packet)
             print(f" [ACK sent for {packet_id}]", end='')
@@ -108,143 +142,224 @@ class ImageReceiver:
             
             # Skip first 3 bytes (sender address + frequency)
             # If RSSI is enabled, skip last byte too
-            if self.node.rssi and len(raw_data) > 3:
-                payload = raw_data[3:-1]  # Skip first 3 and last 1
-            else:
-                payload = raw_data[3:]  # Skip first 3 bytes only
-            
-            # Check packet type
-            if payload.startswith(b'IMGSTART'):
-                self.handle_start_packet(payload)
-                self.send_ack("START")
-            elif payload.startswith(b'IMGDATA'):
-                chunk_num = self.handle_data_packet(payload)
-                if chunk_num is not None:
-                    self.send_ack(f"DATA_{chunk_num}")
-            elif payload.startswith(b'IMG_END'):
-                self.handle_end_packet(payload)
-                self.send_ack("END")
+            # The payload is a view into raw_data, so slicing it doesn't copy
+            payload = memoryview(raw_data)[3:self._payload_end]
+            
+            # The sender appends a CRC of the payload. Drop corrupted
+            # packets without an ACK so the sender sends them again
+            if len(payload) < CRC_FMT.size:
+                return
+            crc_at = len(payload) - CRC_FMT.size
+            (crc,) = CRC_FMT.unpack_from(payload, crc_at)
+            payload = payload[:crc_at]
+            if zlib.crc32(payload) != crc:
+                print("\nDropped packet with bad CRC")
+                return
+            
+            # Check packet type (tags are 8 or 7 bytes long)
+            tag = bytes(payload[:8])
+            handler = self.packet_handlers.get(tag) or self.packet_handlers.get(tag[:7])
+            if handler is not None:
+                packet_id = handler(payload)
+                if packet_id is not None:
+                    self.send_ack(packet_id)
                 
         except Exception as e:
             print(f"\nError processing packet: {e}")
-            import traceback
             traceback.print_exc()
     
     def handle_start_packet(self, payload):
-        """Handle START packet"""
+        """Handle START packet, always ACKed"""
         try:
             self.reset_state()
             
-            # Parse: [Header: 8] [filename_len: 1] [filename: var] [filesize: 4] [total_chunks: 4] [checksum: 32]
+            # Parse: [Header: 8] [filename_len: 1] [filename: var] [filesize: 4] [total_chunks: 4] [checksum: 16]
             idx = 8  # Skip 'IMGSTART'
             filename_len = payload[idx]
             idx += 1
             
-            self.filename = payload[idx:idx+filename_len].decode('utf-8')
+            # Only the name is kept, a path from the radio must never pick
+            # where the file is written
+            self.filename = os.path.basename(bytes(payload[idx:idx+filename_len]).decode('utf-8'))
+            if not self.filename:
+                raise ValueError("START packet has no filename")
             idx += filename_len
             
-            self.filesize = int.from_bytes(payload[idx:idx+4], 'big')
-            idx += 4
+            self.filesize, self.total_chunks = START_SIZES_FMT.unpack_from(payload, idx)
+            idx += START_SIZES_FMT.size
+            
+            self.expected_checksum = bytes(payload[idx:idx+16])
             
-            self.total_chunks = int.from_bytes(payload[idx:idx+4], 'big')
-            idx += 4
+            # A chunk never exceeds the 240 byte LoRa buffer
+            if self.filesize > self.total_chunks * 240:
+                raise ValueError(f"{self.filesize} bytes can't fit in {self.total_chunks} chunks")
             
-            self.expected_checksum = payload[idx:idx+32].decode('utf-8')
+            # Chunks go straight to their place in a sized file, so the
+            # image is never held in memory
+            self.part_path = os.path.join(self.output_dir, f"{self.filename}.part")
+            self.part_fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.ftruncate(self.part_fd, self.filesize)
+            self.chunk_received = bytearray(self.total_chunks)
+            self.image_md5 = hashlib.md5()
             
             self.receiving = True
-            self.start_time = time.time()
-            self.last_packet_time = time.time()
+            self.start_time = time.monotonic()
+            self.last_packet_time = time.monotonic()
             self.packet_times = []
             
             print(f"\n{'='*50}")
             print(f"Receiving image: {self.filename}")
             print(f"Size: {self.filesize} bytes")
             print(f"Total chunks: {self.total_chunks}")
-            print(f"Checksum: {self.expected_checksum}")
+            print(f"Checksum: {self.expected_checksum.hex()}")
             print(f"{'='*50}\n")
             
         except Exception as e:
             print(f"Error parsing START packet: {e}")
             self.reset_state()
+        
+        return "START"
     
     def handle_data_packet(self, payload):
-        """Handle DATA packet"""
+        """Handle DATA packet, ACKed only if it could be parsed"""
         if not self.receiving:
             return None
         
         try:
             # Parse: [Header: 7] [chunk_num: 4] [chunk_data]
-            chunk_num = int.from_bytes(payload[7:11], 'big')
-            chunk_data = payload[11:]
+            chunk_num, = CHUNK_NUM_FMT.unpack_from(payload, 7)
+            chunk_data = payload[11:]  # Still a view, written once to the image file
             
-            # Store chunk
-            if chunk_num not in self.received_chunks:
-                self.received_chunks[chunk_num] = chunk_data
-                
-                # Track packet timing for ETA calculation
-                current_time = time.time()
-                if self.last_packet_time is not None:
-                    time_since_last = current_time - self.last_packet_time
-                    self.packet_times.append(time_since_last)
-                    # Keep only last 10 packets for moving average
-                    if len(self.packet_times) > 10:
-                        self.packet_times.pop(0)
-                self.last_packet_time = current_time
-                
-                # Progress indicator with ETA
-                received_count = len(self.received_chunks)
-                progress = received_count / self.total_chunks * 100
-                
-                # Calculate ETA
-                eta_str = ""
-                if len(self.packet_times) >= 2:
-                    avg_time_per_packet = sum(self.packet_times) / len(self.packet_times)
-                    remaining_packets = self.total_chunks - received_count
-                    eta_seconds = avg_time_per_packet * remaining_packets
-                    
-                    # Format ETA
-                    if eta_seconds < 60:
-                        eta_str = f" | ETA: {eta_seconds:.0f}s"
-                    else:
-                        eta_minutes = eta_seconds / 60
-                        eta_str = f" | ETA: {eta_minutes:.1f}m"
-                
-                elapsed = current_time - self.start_time
-                elapsed_str = f"{elapsed:.1f}s" if elapsed < 60 else f"{elapsed/60:.1f}m"
-                
-                print(f"\rReceived: [{received_count}/{self.total_chunks}] {progress:.1f}% | Elapsed: {elapsed_str}{eta_str}", 
-                      end='', flush=True)
+            self.store_chunk(chunk_num, chunk_data)
             
-            return chunk_num
+            return f"DATA_{chunk_num}"
             
         except Exception as e:
             print(f"\nError parsing DATA packet: {e}")
             return None
     
+    def handle_multi_packet(self, payload):
+        """Handle packet carrying several chunks, ACKed with its first chunk number"""
+        if not self.receiving:
+            return None
+        
+        try:
+            # Parse: [Header: 7] [first_chunk: 4] [count: 1], then [len: 1] [chunk_data] per chunk
+            first_chunk, count = MULTI_HEADER_FMT.unpack_from(payload, 7)
+            idx = 7 + MULTI_HEADER_FMT.size
+            for chunk_num in range(first_chunk, first_chunk + count):
+                chunk_len = payload[idx]
+                idx += 1
+                if idx + chunk_len > len(payload):
+                    raise ValueError(f"chunk {chunk_num} is truncated")
+                self.store_chunk(chunk_num, payload[idx:idx + chunk_len])
+                idx += chunk_len
+            
+            return f"DATA_{first_chunk}"
+            
+        except Exception as e:
+            print(f"\nError parsing MULTI packet: {e}")
+            return None
+    
+    def store_chunk(self, chunk_num, chunk_data):
+        """Write a chunk into the image file and update progress"""
+        if chunk_num >= self.total_chunks:
+            raise ValueError(f"chunk {chunk_num} out of range")
+        
+        # Store chunk
+        if not self.chunk_received[chunk_num]:
+            # All chunks but the last have the same size, and the last one
+            # ends the file, so the offset follows from the chunk length
+            if chunk_num == self.total_chunks - 1:
+                offset = self.filesize - len(chunk_data)
+            else:
+                offset = chunk_num * len(chunk_data)
+            if offset < 0 or offset + len(chunk_data) > self.filesize:
+                raise ValueError(f"chunk {chunk_num} doesn't fit in {self.filesize} bytes")
+            
+            os.pwrite(self.part_fd, chunk_data, offset)
+            self.chunk_received[chunk_num] = 1
+            self.received_count += 1
+            
+            # Hash in-order chunks as they arrive; after the first
+            # out-of-order chunk the whole buffer is hashed at the end
+            if self.image_md5 is not None:
+                if chunk_num == self.next_chunk:
+                    self.image_md5.update(chunk_data)
+                    self.next_chunk += 1
+                else:
+                    self.image_md5 = None
+            
+            # Track packet timing for ETA calculation
+            current_time = time.monotonic()
+            if self.last_packet_time is not None:
+                time_since_last = current_time - self.last_packet_time
+                self.packet_times.append(time_since_last)
+                # Keep only last 10 packets for moving average
+                if len(self.packet_times) > 10:
+                    self.packet_times.pop(0)
+            self.last_packet_time = current_time
+            
+            # Progress indicator with ETA
+            received_count = self.received_count
+            progress = received_count / self.total_chunks * 100
+            
+            # Calculate ETA
+            eta_str = ""
+            if len(self.packet_times) >= 2:
+                avg_time_per_packet = sum(self.packet_times) / len(self.packet_times)
+                remaining_packets = self.total_chunks - received_count
+                eta_seconds = avg_time_per_packet * remaining_packets
+                
+                # Format ETA
+                if eta_seconds < 60:
+                    eta_str = f" | ETA: {eta_seconds:.0f}s"
+                else:
+                    eta_minutes = eta_seconds / 60
+                    eta_str = f" | ETA: {eta_minutes:.1f}m"
+            
+            elapsed = current_time - self.start_time
+            elapsed_str = f"{elapsed:.1f}s" if elapsed < 60 else f"{elapsed/60:.1f}m"
+            
+            print(f"\rReceived: [{received_count}/{self.total_chunks}] {progress:.1f}% | Elapsed: {elapsed_str}{eta_str}", 
+                  end='', flush=True)
+    
     def handle_end_packet(self, payload):
-        """Handle END packet and save the image"""
+        """Handle END packet and save the image, always ACKed"""
         if not self.receiving:
-            return
+            return "END"
         
         try:
             print("\n\nReceived END packet. Processing image...")
             
             # Check if we have all chunks
-            if len(self.received_chunks) != self.total_chunks:
-                missing = self.total_chunks - len(self.received_chunks)
+            missing = self.chunk_received.count(0)
+            if missing:
                 print(f"Warning: Missing {missing} chunks!")
-                print(f"Received {len(self.received_chunks)}/{self.total_chunks} chunks")
-            
-            # Reassemble image
-            image_data = b''
-            for i in range(self.total_chunks):
-                if i in self.received_chunks:
-                    image_data += self.received_chunks[i]
-                else:
+                print(f"Received {self.received_count}/{self.total_chunks} chunks")
+                # Jump from one unset flag to the next instead of testing each
+                i = self.chunk_received.find(0)
+                while i != -1:
                     print(f"Missing chunk {i}")
+                    i = self.chunk_received.find(0, i + 1)
+            
+            # Chunks were written in place, missing ones are left as zeros.
+            # Flush them to disk before the rename so a power cut can't
+            # leave a finished name on an empty file
+            os.fsync(self.part_fd)
+            os.close(self.part_fd)
+            self.part_fd = None
             
             # Verify checksum
-            actual_checksum = self.calculate_checksum(image_data)
+            if self.image_md5 is not None and self.next_chunk == self.total_chunks:
+                actual_checksum = self.image_md5.digest()
+            else:
+                # Hash the file in blocks so it's never read into memory whole
+                md5 = hashlib.md5()
+                with open(self.part_path, 'rb') as f:
+                    for block in iter(lambda: f.read(65536), b''):
+                        md5.update(block)
+                actual_checksum = md5.digest()
             checksum_match = actual_checksum == self.expected_checksum
             
             # Save image
@@ -252,19 +367,18 @@ class ImageReceiver:
             output_filename = f"{timestamp}_{self.filename}"
             output_path = os.path.join(self.output_dir, output_filename)
             
-            with open(output_path, 'wb') as f:
-                f.write(image_data)
+            os.rename(self.part_path, output_path)
             
             # Calculate statistics
-            duration = time.time() - self.start_time
+            duration = time.monotonic() - self.start_time
             throughput = self.filesize / duration if duration > 0 else 0
             
             print(f"\n{'='*50}")
             print(f"Image saved: {output_path}")
-            print(f"File size: {len(image_data)} bytes (expected: {self.filesize})")
+            print(f"File size: {os.path.getsize(output_path)} bytes (expected: {self.filesize})")
             print(f"Checksum match: {'✓ YES' if checksum_match else '✗ NO'}")
-            print(f"  Expected: {self.expected_checksum}")
-            print(f"  Actual:   {actual_checksum}")
+            print(f"  Expected: {self.expected_checksum.hex()}")
+            print(f"  Actual:   {actual_checksum.hex()}")
             print(f"Transfer time: {duration:.2f} seconds")
             print(f"Throughput: {throughput:.2f} bytes/sec")
             print(f"{'='*50}\n")
@@ -273,9 +387,10 @@ class ImageReceiver:
             
         except Exception as e:
             print(f"\nError saving image: {e}")
-            import traceback
             traceback.print_exc()
             self.reset_state()
+        
+        return "END"
     
     def listen(self):
         """Listen for incoming packets"""
@@ -288,43 +403,48 @@ class ImageReceiver:
         print("-" * 50 + "\n")
         
         packet_count = 0
-        last_check_time = time.time()
+        last_check_time = time.monotonic()
+        
+        # Bind the serial port and handler once for the receive loop
+        ser = self.node.ser
+        read = ser.read
+        fd = ser.fileno()
+        process_packet = self.process_packet
         
         try:
             while True:
-                # Check if data is available
-                bytes_waiting = self.node.ser.inWaiting()
+                # Block until the first byte arrives (or the read times out)
+                first_byte = read(1)
+                if not first_byte:
+                    continue
                 
-                if bytes_waiting > 0:
-                    # Show that we detected data
-                    current_time = time.time()
-                    if current_time - last_check_time > 2:  # Print status every 2 seconds
-                        print(f"[Status] Buffer has {bytes_waiting} bytes waiting...")
-                        last_check_time = current_time
-                    
-                    # Give more time for complete packet to arrive at slow air speed
-                    time.sleep(0.3)
+                # Show that we detected data
+                current_time = time.monotonic()
+                if current_time - last_check_time > 2:  # Print status every 2 seconds
+                    bytes_waiting = len(first_byte) + ser.in_waiting
+                    print(f"[Status] Buffer has {bytes_waiting} bytes waiting...")
+                    last_check_time = current_time
+                
+                # Keep reading until the line has been quiet for 20 ms,
+                # which marks the end of the frame
+                raw_data = bytearray(first_byte)
+                while select.select([fd], [], [], 0.02)[0]:
+                    raw_data += read(ser.in_waiting or 1)
+                
+                if len(raw_data) > 3:
+                    packet_count += 1
                     
-                    # Read what's available now
-                    raw_data = self.node.ser.read(self.node.ser.inWaiting())
+                    # Tags start after the 3-byte sender header
+                    if raw_data.startswith(b'IMGSTART', 3):
+                        print(f"\n[Packet #{packet_count}] START packet ({len(raw_data)} bytes)")
+                    elif raw_data.startswith(b'IMG_END', 3):
+                        print(f"\n[Packet #{packet_count}] END packet ({len(raw_data)} bytes)")
+                    elif raw_data.startswith((b'IMGDATA', b'IMGMULT'), 3):
+                        # Show occasional progress for data packets
+                        if packet_count % 10 == 0:
+                            print(f"[Packet #{packet_count}] DATA packet ({len(raw_data)} bytes)")
                     
-                    if len(raw_data) > 3:
-                        packet_count += 1
-                        
-                        payload = raw_data[3:]
-                        if payload.startswith(b'IMGSTART'):
-                            print(f"\n[Packet #{packet_count}] START packet ({len(raw_data)} bytes)")
-                        elif payload.startswith(b'IMG_END'):
-                            print(f"\n[Packet #{packet_count}] END packet ({len(raw_data)} bytes)")
-                        elif payload.startswith(b'IMGDATA'):
-                            # Show occasional progress for data packets
-                            if packet_count % 10 == 0:
-                                print(f"[Packet #{packet_count}] DATA packet ({len(raw_data)} bytes)")
-                        
-                        self.process_packet(raw_data)
-                else:
-                    # No data waiting, small sleep to prevent CPU spinning
-                    time.sleep(0.01)
+                    process_packet(raw_data)
                 
         except KeyboardInterrupt:
             print("\n\nReceiver stopped by user")
@@ -355,7 +475,6 @@ def main():
         
     except Exception as e:
         print(f"\nError: {e}")
-        import traceback
         traceback.print_exc()
     finally:
         # Restore terminal settings
@@ -11,6 +11,31 @@ import sx126x
 import time
 import os
 import hashlib
+import mmap
+import select
+import struct
+import zlib
+
+# LoRa addressing header:
+# [target_addr: 2] [target_freq_offset: 1] [own_addr: 2] [own_freq_offset: 1]
+HEADER_FMT = struct.Struct('>HBHB')
+
+# Check value after every payload: its CRC-32
+CRC_FMT = struct.Struct('>I')
+
+# Room left in the 240 byte LoRa buffer after the addressing header and CRC
+PAYLOAD_SIZE = 240 - HEADER_FMT.size - CRC_FMT.size
+
+# Header of a packet carrying one chunk:
+# [Header: 'IMGDATA'] [chunk_num: 4], then [data]
+DATA_HEADER_FMT = struct.Struct('>7sI')
+
+# Header of a packet carrying several chunks:
+# [Header: 'IMGMULT'] [first_chunk: 4] [count: 1], then [len: 1] [data] per chunk
+MULTI_HEADER_FMT = struct.Struct('>7sIB')
+
+# END packet: [Header: 'IMG_END'] [total_chunks: 4] [checksum: 16]
+END_FMT = struct.Struct('>7sI16s')
 
 class ImageSender:
     def __init__(self, serial_num="/dev/ttyS0", freq=868, addr=0, power=22, 
@@ -38,16 +63,24 @@ class ImageSender:
             buffer_size=240,
             relay=False
         )
+        # Blocking reads give up after this many seconds, so waiting for
+        # an ACK wakes on its first byte instead of polling
+        self.node.ser.timeout = 0.1
         
         self.target_addr = target_addr
         self.chunk_size = chunk_size
         self.freq = freq
         self.offset_freq = freq - (850 if freq > 850 else 410)
+        # Addressing never changes during a transfer, so pack it once
+        self.header = HEADER_FMT.pack(self.target_addr, self.offset_freq,
+                                      self.node.addr, self.node.offset_freq)
+        # Chunks small enough to share a packet are sent several at a time
+        self.chunks_per_packet = max(1, (PAYLOAD_SIZE - MULTI_HEADER_FMT.size) // (chunk_size + 1))
         print("LoRa module initialized successfully!")
         
     def calculate_checksum(self, data):
-        """Calculate MD5 checksum of data"""
-        return hashlib.md5(data).hexdigest()
+        """Calculate MD5 checksum of data (16 raw bytes)"""
+        return hashlib.md5(data).digest()
     
     def wait_for_ack(self, packet_id, timeout=5.0):
         """
@@ -60,23 +93,29 @@ class ImageSender:
         Returns:
             True if ACK received, False if timeout
         """
-        start_time = time.time()
+        deadline = time.monotonic() + timeout
         expected_ack = f"ACK_{packet_id}".encode()
+        ser = self.node.ser
+        fd = ser.fileno()
         
-        while time.time() - start_time < timeout:
-            if self.node.ser.inWaiting() > 0:
-                time.sleep(0.1)  # Wait a bit for complete ACK
-                response = self.node.ser.read(self.node.ser.inWaiting())
-                
-                # ACK format: [addr][addr][freq][ACK_xxxxx]
-                if len(response) > 3:
-                    payload = response[3:]
-                    if payload.startswith(b'ACK_'):
-                        # Got an ACK, check if it's for our packet
-                        if expected_ack in payload or b'ACK_' in payload:
-                            return True
+        while time.monotonic() < deadline:
+            first_byte = ser.read(1)
+            if not first_byte:
+                continue
+            
+            # Keep reading until the line has been quiet for 20 ms,
+            # which marks the end of the ACK
+            response = bytearray(first_byte)
+            while select.select([fd], [], [], 0.02)[0]:
+                response += ser.read(ser.in_waiting or 1)
             
-            time.sleep(0.05)
+            # ACK format: [addr][addr][freq][ACK_xxxxx]
+            if len(response) > 3:
+                payload = response[3:]
+                if payload.startswith(b'ACK_'):
+                    # Got an ACK, check if it's for our packet
+                    if expected_ack in payload or b'ACK_' in payload:
+                        return True
         
         return False
     
@@ -94,10 +133,14 @@ class ImageSender:
             print(f"Error: Image file '{image_path}' not found!")
             return False
             
-        # Read the image file
+        # Map the image file instead of reading a copy of it into memory
         try:
             with open(image_path, 'rb') as f:
-                image_data = f.read()
+                # Empty files can't be mapped, and have nothing to read anyway
+                if os.fstat(f.fileno()).st_size:
+                    image_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    image_data = b''
         except Exception as e:
             print(f"Error reading image file: {e}")
             return False
@@ -106,14 +149,20 @@ class ImageSender:
         file_name = os.path.basename(image_path)
         checksum = self.calculate_checksum(image_data)
         
+        # Calculate number of chunks
+        total_chunks = (file_size + self.chunk_size - 1) // self.chunk_size
+        
+        # Build every data packet once up front, so retries resend the same bytes
+        packets = self.build_data_packets(image_data, total_chunks)
+        if isinstance(image_data, mmap.mmap):
+            image_data.close()
+        
         print(f"\n{'='*50}")
         print(f"Image: {file_name}")
         print(f"Size: {file_size} bytes")
-        print(f"Checksum: {checksum}")
+        print(f"Checksum: {checksum.hex()}")
         print(f"{'='*50}\n")
         
-        # Calculate number of chunks
-        total_chunks = (file_size + self.chunk_size - 1) // self.chunk_size
         print(f"Splitting into {total_chunks} chunks of {self.chunk_size} bytes each\n")
         
         # Send START packet with metadata
@@ -130,22 +179,21 @@ class ImageSender:
         
         # Send data chunks
         failed_chunks = []
-        for chunk_num in range(total_chunks):
-            start_idx = chunk_num * self.chunk_size
-            end_idx = min(start_idx + self.chunk_size, file_size)
-            chunk_data = image_data[start_idx:end_idx]
+        for chunk_nums, packet in packets:
+            first_chunk = chunk_nums[0]
             
             # Try sending with retries
             success = False
             for attempt in range(max_retries):
-                self.send_data_packet(chunk_num, chunk_data)
+                self.node.send(packet)
                 
                 if wait_for_ack:
-                    if self.wait_for_ack(f"DATA_{chunk_num}", timeout=5.0):
+                    # Multi-chunk packets are ACKed with their first chunk number
+                    if self.wait_for_ack(f"DATA_{first_chunk}", timeout=5.0):
                         success = True
                         break
                     elif attempt < max_retries - 1:
-                        print(f"\nRetry chunk {chunk_num} (attempt {attempt + 2}/{max_retries})")
+                        print(f"\nRetry chunk {first_chunk} (attempt {attempt + 2}/{max_retries})")
                         time.sleep(0.5)
                 else:
                     success = True
@@ -153,14 +201,12 @@ class ImageSender:
                     break
             
             if not success:
-                failed_chunks.append(chunk_num)
+                failed_chunks.extend(chunk_nums)
             
             # Progress indicator
-            progress = (chunk_num + 1) / total_chunks * 100
-            print(f"\rProgress: [{chunk_num + 1}/{total_chunks}] {progress:.1f}%", end='', flush=True)
-            
-            if wait_for_ack:
-                time.sleep(0.1)  # Small delay between packets when using ACK
+            sent_chunks = chunk_nums[-1] + 1
+            progress = sent_chunks / total_chunks * 100
+            print(f"\rProgress: [{sent_chunks}/{total_chunks}] {progress:.1f}%", end='', flush=True)
         
         print("\n")
         
@@ -180,53 +226,71 @@ class ImageSender:
     
     def send_start_packet(self, filename, filesize, total_chunks, checksum):
         """Send START packet with file metadata"""
-        # Packet format: [Header: 'IMGSTART'] [filename_len] [filename] [filesize] [total_chunks] [checksum]
+        # Packet format: [Header: 'IMGSTART'] [filename_len] [filename] [filesize] [total_chunks] [checksum: 16]
         header = b'IMGSTART'
         filename_bytes = filename.encode('utf-8')[:50]  # Limit filename to 50 chars
         filename_len = len(filename_bytes)
         
         # Create metadata payload
-        metadata = header + bytes([filename_len]) + filename_bytes
-        metadata += filesize.to_bytes(4, 'big')
-        metadata += total_chunks.to_bytes(4, 'big')
-        metadata += checksum.encode('utf-8')[:32]
+        metadata = struct.pack(f'>8sB{filename_len}sII16s', header, filename_len, filename_bytes,
+                               filesize, total_chunks, checksum)
         
         self.send_packet(metadata)
         print("Sent START packet with metadata")
     
-    def send_data_packet(self, chunk_num, chunk_data):
-        """Send a data chunk packet"""
+    def build_data_packets(self, image_data, total_chunks):
+        """Build the data packets of an image, as a list of (chunk_nums, packet)"""
+        # Chunks are sliced from a view so they aren't copied out first
+        image_view = memoryview(image_data)
+        packets = []
+        for first_chunk in range(0, total_chunks, self.chunks_per_packet):
+            chunk_nums = range(first_chunk, min(first_chunk + self.chunks_per_packet, total_chunks))
+            chunks = [image_view[n * self.chunk_size:(n + 1) * self.chunk_size] for n in chunk_nums]
+            if len(chunks) == 1:
+                payload = self.build_data_payload(first_chunk, chunks[0])
+            else:
+                payload = self.build_multi_payload(first_chunk, chunks)
+            packets.append((chunk_nums, self.build_packet(payload)))
+        return packets
+    
+    def build_data_payload(self, chunk_num, chunk_data):
+        """Build the payload of a data chunk packet"""
         # Packet format: [Header: 'IMGDATA'] [chunk_num: 4 bytes] [chunk_data]
-        header = b'IMGDATA'
-        chunk_num_bytes = chunk_num.to_bytes(4, 'big')
-        packet_payload = header + chunk_num_bytes + chunk_data
-        
-        self.send_packet(packet_payload)
+        return DATA_HEADER_FMT.pack(b'IMGDATA', chunk_num) + chunk_data
+    
+    def build_multi_payload(self, first_chunk, chunks):
+        """Build the payload of a packet carrying several consecutive data chunks"""
+        # Packet format: [Header: 'IMGMULT'] [first_chunk: 4 bytes] [count: 1 byte]
+        #                [len: 1 byte] [chunk_data] for each chunk
+        packet_payload = MULTI_HEADER_FMT.pack(b'IMGMULT', first_chunk, len(chunks))
+        packet_payload += b''.join(bytes([len(chunk_data)]) + chunk_data for chunk_data in chunks)
+        return packet_payload
     
     def send_end_packet(self, total_chunks, checksum):
         """Send END packet to signal transmission complete"""
-        # Packet format: [Header: 'IMG_END'] [total_chunks] [checksum]
-        header = b'IMG_END'
-        packet_payload = header + total_chunks.to_bytes(4, 'big') + checksum.encode('utf-8')[:32]
+        # Packet format: [Header: 'IMG_END'] [total_chunks] [checksum: 16]
+        packet_payload = END_FMT.pack(b'IMG_END', total_chunks, checksum)
         
         self.send_packet(packet_payload)
         print("Sent END packet")
     
-    def send_packet(self, payload):
+    def build_packet(self, payload):
         """
-        Send a packet via LoRa with proper addressing
+        Build a LoRa packet with proper addressing
         Format: [target_addr_high] [target_addr_low] [freq_offset] 
-                [own_addr_high] [own_addr_low] [own_freq_offset] [payload]
+                [own_addr_high] [own_addr_low] [own_freq_offset] [payload] [crc]
         """
-        packet = bytes([self.target_addr >> 8])  # Target address high byte
-        packet += bytes([self.target_addr & 0xff])  # Target address low byte
-        packet += bytes([self.offset_freq])  # Target frequency offset
-        packet += bytes([self.node.addr >> 8])  # Own address high byte
-        packet += bytes([self.node.addr & 0xff])  # Own address low byte
-        packet += bytes([self.node.offset_freq])  # Own frequency offset
-        packet += payload
-        
-        self.node.send(packet)
+        # Filled in place: one buffer per packet instead of a chain of concatenations
+        crc_at = HEADER_FMT.size + len(payload)
+        packet = bytearray(crc_at + CRC_FMT.size)
+        packet[:HEADER_FMT.size] = self.header
+        packet[HEADER_FMT.size:crc_at] = payload
+        CRC_FMT.pack_into(packet, crc_at, zlib.crc32(payload))
+        return packet
+    
+    def send_packet(self, payload):
+        """Send a packet via LoRa with proper addressing"""
+        self.node.send(self.build_packet(payload))
 
 
 def main():
@@ -126,7 +126,10 @@ try:
     
     while True:
 
-        if select.select([sys.stdin], [], [], 0) == ([sys.stdin], [], []):
+        # sleep until a key is pressed or the LoRa module has data
+        ready = select.select([sys.stdin, node.ser], [], [])[0]
+
+        if sys.stdin in ready:
             c = sys.stdin.read(1)
 
             # dectect key Esc
@@ -150,7 +153,8 @@ try:
 
             sys.stdout.flush()
             
-        node.receive()
+        if node.ser in ready:
+            node.receive()
         
         # timer,send messages automatically
         
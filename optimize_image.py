@@ -8,6 +8,9 @@ Compresses and resizes images for optimal LoRa transmission
 
 import sys
 import os
+import io
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
 
 class ImageOptimizer:
@@ -23,10 +26,11 @@ class ImageOptimizer:
     def __init__(self):
         pass
     
-    def get_image_info(self, image_path):
-        """Get image information"""
+    def get_image_info(self, image_path, img=None):
+        """Get image information, reusing img if it's already open"""
         try:
-            img = Image.open(image_path)
+            if img is None:
+                img = Image.open(image_path)
             size = img.size
             mode = img.mode
             file_size = os.path.getsize(image_path)
@@ -59,7 +63,7 @@ class ImageOptimizer:
         try:
             # Open image
             img = Image.open(input_path)
-            original_info = self.get_image_info(input_path)
+            original_info = self.get_image_info(input_path, img)
             
             # Get preset or custom settings
             if custom_size and quality:
@@ -73,20 +77,29 @@ class ImageOptimizer:
                 print(f"Unknown preset: {preset}")
                 return None
             
-            # Convert to RGB if necessary (for JPEG)
-            if img.mode in ('RGBA', 'P', 'LA'):
-                # Create white background
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                img = background
-            elif img.mode != 'RGB':
+            # Convert to RGB if necessary (for JPEG), keeping alpha until
+            # after the resize. Palette images can't be resampled smoothly.
+            # L and CMYK resize fine and are converted after the resize, so
+            # nothing loads the pixels before thumbnail() drafts the decode
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            elif img.mode not in ('RGB', 'RGBA', 'LA', 'L', 'CMYK'):
                 img = img.convert('RGB')
             
-            # Resize maintaining aspect ratio
+            # Resize maintaining aspect ratio. For JPEGs, thumbnail() first
+            # lets the decoder scale down by 1/2, 1/4 or 1/8 while keeping
+            # at least twice the target size for LANCZOS to work from
             img.thumbnail(target_size, Image.Resampling.LANCZOS)
             
+            if img.mode in ('L', 'CMYK'):
+                img = img.convert('RGB')
+            
+            # Flatten transparency onto white at the target size, not the source size
+            if img.mode in ('RGBA', 'LA'):
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+            
             # Generate output path if not provided
             if output_path is None:
                 base, ext = os.path.splitext(input_path)
@@ -96,7 +109,7 @@ class ImageOptimizer:
             img.save(output_path, 'JPEG', quality=target_quality, optimize=True)
             
             # Get optimized info
-            optimized_info = self.get_image_info(output_path)
+            optimized_info = self.get_image_info(output_path, img)
             
             # Print results
             print("\n" + "="*60)
@@ -159,19 +172,35 @@ class ImageOptimizer:
         print(f"Found {len(images)} images to optimize\n")
         
         success_count = 0
-        for i, image_name in enumerate(images, 1):
-            input_path = os.path.join(input_dir, image_name)
-            output_name = os.path.splitext(image_name)[0] + '_optimized.jpg'
-            output_path = os.path.join(output_dir, output_name)
-            
-            print(f"[{i}/{len(images)}] Processing: {image_name}")
+        # Each image is independent CPU work, so spread them over all cores
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = {}
+            for image_name in images:
+                input_path = os.path.join(input_dir, image_name)
+                output_name = os.path.splitext(image_name)[0] + '_optimized.jpg'
+                output_path = os.path.join(output_dir, output_name)
+                futures[executor.submit(_optimize_one, input_path, output_path, preset)] = image_name
             
-            if self.optimize_image(input_path, output_path, preset):
-                success_count += 1
+            for i, future in enumerate(as_completed(futures), 1):
+                print(f"[{i}/{len(images)}] Processed: {futures[future]}")
+                
+                result, output = future.result()
+                print(output, end='')
+                if result:
+                    success_count += 1
         
         print(f"\nBatch optimization complete: {success_count}/{len(images)} successful")
 
 
+def _optimize_one(input_path, output_path, preset):
+    """Optimize one image in a worker process, returning (result, printed output)"""
+    # Capture the report so it doesn't interleave with other workers
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        result = ImageOptimizer().optimize_image(input_path, output_path, preset)
+    return result, output.getvalue()
+
+
 def print_usage():
     """Print usage information"""
     print("\n" + "="*60)
@@ -80,9 +80,43 @@ print_info "Installing pyserial..."
 sudo pip3 install pyserial --break-system-packages > /dev/null 2>&1
 print_status $? "pyserial installed"
 
-print_info "Installing Pillow (for image optimization)..."
-sudo pip3 install Pillow --break-system-packages > /dev/null 2>&1
-print_status $? "Pillow installed (optional)"
+# Pillow-SIMD is a drop-in Pillow fork with SSE4/AVX2 resize and JPEG
+# paths, so it's only worth building on x86. On the Pi (ARM), stock Pillow
+# wheels already ship with libjpeg-turbo and its NEON code.
+if [ "$(uname -m)" = "x86_64" ]; then
+    print_info "Installing Pillow-SIMD with libjpeg-turbo (for image optimization)..."
+    sudo apt-get install -y build-essential python3-dev libjpeg-turbo8-dev zlib1g-dev > /dev/null 2>&1 || \
+        sudo apt-get install -y build-essential python3-dev libjpeg62-turbo-dev zlib1g-dev > /dev/null 2>&1
+    
+    # Only build the AVX2 paths if this CPU can run them (SIGILL otherwise)
+    SIMD_CC="cc"
+    if grep -q avx2 /proc/cpuinfo; then
+        SIMD_CC="cc -mavx2"
+    fi
+    
+    # Build the wheel before touching Pillow, so a failed build leaves the
+    # stock Pillow in place
+    SIMD_DIR=$(mktemp -d)
+    if CC="$SIMD_CC" pip3 wheel --no-binary :all: --no-deps -w "$SIMD_DIR" pillow-simd > /dev/null 2>&1; then
+        sudo pip3 uninstall -y Pillow --break-system-packages > /dev/null 2>&1
+        if sudo pip3 install --no-index "$SIMD_DIR"/*.whl --break-system-packages > /dev/null 2>&1; then
+            print_status 0 "Pillow-SIMD installed (optional)"
+        else
+            print_status 1 "Pillow-SIMD install failed, reinstalling stock Pillow"
+            sudo pip3 install Pillow --break-system-packages > /dev/null 2>&1
+            print_status $? "Pillow installed (optional)"
+        fi
+    else
+        print_status 1 "Pillow-SIMD build failed, installing stock Pillow instead"
+        sudo pip3 install Pillow --break-system-packages > /dev/null 2>&1
+        print_status $? "Pillow installed (optional)"
+    fi
+    rm -rf "$SIMD_DIR"
+else
+    print_info "Installing Pillow (for image optimization)..."
+    sudo pip3 install Pillow --break-system-packages > /dev/null 2>&1
+    print_status $? "Pillow installed (optional)"
+fi
 
 echo ""
 echo "════════════════════════════════════════════════════════════════"
@@ -3,6 +3,12 @@
 import RPi.GPIO as GPIO
 import serial
 import time
+import os
+import select
+import struct
+
+# received message header: [sender address: 2] [sender frequence offset: 1]
+RECV_HEADER = struct.Struct('>HB')
 
 class sx126x:
 
@@ -245,7 +251,15 @@ class sx126x:
         GPIO.output(self.M0,GPIO.LOW)
         time.sleep(0.1)
 
-        self.ser.write(data)
+        # write straight to the port's fd, pyserial opens it non-blocking
+        # so wait for room whenever the kernel buffer is full
+        fd = self.ser.fileno()
+        mv = memoryview(data)
+        while mv:
+            try:
+                mv = mv[os.write(fd, mv):]
+            except BlockingIOError:
+                select.select([],[fd],[])
         # if self.rssi == True:
             # self.get_channel_rssi()
         time.sleep(0.1)
@@ -256,7 +270,8 @@ class sx126x:
             time.sleep(0.5)
             r_buff = self.ser.read(self.ser.inWaiting())
 
-            print("receive message from node address with frequence\033[1;32m %d,%d.125MHz\033[0m"%((r_buff[0]<<8)+r_buff[1],r_buff[2]+self.start_freq),end='\r\n',flush = True)
+            sender_addr,sender_freq = RECV_HEADER.unpack_from(r_buff)
+            print("receive message from node address with frequence\033[1;32m %d,%d.125MHz\033[0m"%(sender_addr,sender_freq+self.start_freq),end='\r\n',flush = True)
             print("message is "+str(r_buff[3:-1]),end='\r\n')
             
             # print the rssi
@@ -6,27 +6,46 @@ Test script for LoRa Image Transmission System
 Creates a small test image and verifies the transmission setup
 """
 
+import io
 import os
 import sys
-from PIL import Image, ImageDraw, ImageFont
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
 import random
 
-def create_test_image(filename="test_image.jpg", size=(320, 240)):
+@functools.lru_cache(maxsize=None)
+def _default_font():
+    """PIL's built-in bitmap font, loaded once for all test images"""
+    from PIL import ImageFont
+    return ImageFont.load_default()
+
+# Rough transmission time: ~250 bytes/sec over LoRa plus 20% overhead
+_EST_SECONDS_PER_BYTE = 1.2 / 250
+
+def print_banner(title):
+    """Print a section banner with a single write"""
+    sys.stdout.write(f"\n{'='*60}\n{title}\n{'='*60}\n\n")
+
+
+def create_test_image(filename="test_image.jpg", size=(320, 240), verbose=True):
     """
     Create a simple test JPEG image
     
     Args:
         filename: Output filename
         size: Image size tuple (width, height)
+        verbose: Print progress (default: True)
     """
-    print(f"Creating test image: {filename}")
+    # Imported here rather than at the top, so a missing Pillow is
+    # reported by verify_requirements instead of failing on import
+    from PIL import Image, ImageDraw
+    
+    if verbose:
+        print(f"Creating test image: {filename}")
     
     # Create image with random background color
-    img = Image.new('RGB', size, color=(
-        random.randint(50, 200),
-        random.randint(50, 200),
-        random.randint(50, 200)
-    ))
+    img = Image.new('RGB', size, color=tuple(random.choices(range(50, 201), k=3)))
     
     draw = ImageDraw.Draw(img)
     
@@ -46,30 +65,35 @@ def create_test_image(filename="test_image.jpg", size=(320, 240)):
     ], fill='green', outline='yellow')
     
     # Add text
-    try:
-        # Try to use default font
-        draw.text((20, 150), "LoRa Test Image", fill='white')
-        draw.text((20, 170), f"Size: {size[0]}x{size[1]}", fill='white')
-        draw.text((20, 190), "Generated for testing", fill='yellow')
-    except:
-        print("Note: Default font used (PIL font unavailable)")
+    font = _default_font()
+    draw.text((20, 150), "LoRa Test Image", fill='white', font=font)
+    draw.text((20, 170), f"Size: {size[0]}x{size[1]}", fill='white', font=font)
+    draw.text((20, 190), "Generated for testing", fill='yellow', font=font)
+    
+    # Save as JPEG, encoding in memory so the size is known without a stat
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=85, optimize=True, subsampling=2)
+    data = buffer.getbuffer()
+    file_size = data.nbytes
+    with open(filename, 'wb') as f:
+        f.write(data)
     
-    # Save as JPEG
-    img.save(filename, 'JPEG', quality=85)
-    file_size = os.path.getsize(filename)
+    if verbose:
+        print_image_summary(size, file_size)
     
+    return filename, file_size
+
+
+def print_image_summary(size, file_size):
+    """Print the details of a created test image"""
     print(f"✓ Test image created successfully!")
     print(f"  Size: {size[0]}x{size[1]} pixels")
     print(f"  File size: {file_size} bytes ({file_size/1024:.2f} KB)")
-    
-    return filename, file_size
 
 
 def create_sample_images():
     """Create multiple test images of different sizes"""
-    print("\n" + "="*60)
-    print("Creating Sample Test Images")
-    print("="*60 + "\n")
+    print_banner("Creating Sample Test Images")
     
     samples = [
         ("small_test.jpg", (160, 120)),   # ~5-10 KB
@@ -79,17 +103,23 @@ def create_sample_images():
     
     created_files = []
     
-    for filename, size in samples:
+    # Pillow releases the GIL while encoding, so the images are made in
+    # parallel and reported afterwards in order
+    with ThreadPoolExecutor(max_workers=len(samples)) as executor:
+        futures = [executor.submit(create_test_image, filename, size, verbose=False)
+                   for filename, size in samples]
+    
+    for (filename, size), future in zip(samples, futures):
+        print(f"Creating test image: {filename}")
         try:
-            filepath, filesize = create_test_image(filename, size)
+            filepath, filesize = future.result()
+            print_image_summary(size, filesize)
             created_files.append((filepath, filesize))
             print()
         except Exception as e:
             print(f"✗ Failed to create {filename}: {e}\n")
     
-    print("="*60)
-    print(f"Created {len(created_files)} test images")
-    print("="*60 + "\n")
+    print(f"{'='*60}\nCreated {len(created_files)} test images\n{'='*60}\n")
     
     # Print usage instructions
     print("Usage Instructions:")
@@ -99,7 +129,7 @@ def create_sample_images():
     
     print("2. Send a test image from the sending Raspberry Pi:")
     for filepath, filesize in created_files:
-        est_time = (filesize / 250) * 1.2  # Rough estimate
+        est_time = filesize * _EST_SECONDS_PER_BYTE
         print(f"   python3 image_sender.py {filepath}")
         print(f"   (Estimated time: ~{est_time:.0f} seconds)\n")
     
@@ -110,9 +140,7 @@ def create_sample_images():
 
 def verify_requirements():
     """Verify that required libraries are available"""
-    print("\n" + "="*60)
-    print("Verifying Requirements")
-    print("="*60 + "\n")
+    print_banner("Verifying Requirements")
     
     requirements = {
         'PIL': 'Pillow (for test image generation)',
@@ -123,10 +151,15 @@ def verify_requirements():
     missing = []
     
     for module, description in requirements.items():
+        # Only look the module up, importing it would load its C extensions
         try:
-            __import__(module)
+            found = find_spec(module) is not None
+        except ImportError:  # Parent package of a dotted name is missing
+            found = False
+        
+        if found:
             print(f"✓ {module:15} - {description}")
-        except ImportError:
+        else:
             print(f"✗ {module:15} - {description} - NOT FOUND")
             missing.append(module)
     
@@ -148,18 +181,34 @@ def verify_requirements():
         return True
 
 
-def check_serial_port():
-    """Check if serial port is accessible"""
-    print("\n" + "="*60)
-    print("Checking Serial Port")
-    print("="*60 + "\n")
+def check_serial_port(thorough=False):
+    """
+    Check if serial port is accessible
+    
+    Args:
+        thorough: Open the port with pyserial instead of only checking
+                  permissions (default: False)
+    """
+    print_banner("Checking Serial Port")
     
     serial_port = "/dev/ttyS0"
     
     if os.path.exists(serial_port):
         print(f"✓ Serial port {serial_port} exists")
         
-        # Check if accessible
+        # Check permissions without opening, which would reconfigure the UART
+        if not os.access(serial_port, os.R_OK | os.W_OK):
+            print(f"✗ Permission denied on {serial_port}")
+            print(f"\nFix with:")
+            print(f"  sudo usermod -a -G dialout $USER")
+            print(f"  (then logout and login again)")
+            return False
+        
+        if not thorough:
+            print(f"✓ Serial port {serial_port} is accessible")
+            return True
+        
+        # Check if it really opens
         try:
             import serial
             ser = serial.Serial(serial_port, 9600, timeout=1)
@@ -185,9 +234,7 @@ def check_serial_port():
 
 
 def main():
-    print("\n" + "="*60)
-    print("LoRa Image Transmission - Test Script")
-    print("="*60)
+    print(f"\n{'='*60}\nLoRa Image Transmission - Test Script\n{'='*60}")
     
     # Check requirements
     if not verify_requirements():
@@ -197,7 +244,7 @@ def main():
     # Check serial port (only if RPi.GPIO is available)
     try:
         import RPi.GPIO
-        check_serial_port()
+        check_serial_port(thorough='--thorough' in sys.argv)
     except ImportError:
         print("\n⚠ Skipping serial port check (not on Raspberry Pi)")
     
@@ -215,9 +262,7 @@ def main():
     else:
         print("\nSkipped test image creation")
     
-    print("\n" + "="*60)
-    print("Test Complete!")
-    print("="*60 + "\n")
+    print_banner("Test Complete!")
 
 
 if __name__ == "__main__":